@@ -10,6 +10,696 @@ from qgis.core import *
 import math
 import processing
 import os
+import threading
+import numpy
+from collections import OrderedDict
+from urllib.parse import urlencode, parse_qsl
+
+#store the aspect and slope class breaks shared by the raster calculator pass and the dynamic layer
+#aspect is binned into the eight cardinal directions (10 to 80, north wraps around to 10)
+ASPECTBIN = 45
+#slope is binned at 5, 15, 30 and 45 degrees (0 to 8)
+SLOPEBREAKS = [5, 15, 30, 45]
+
+#calculate the aspect class codes of an array of aspect values
+def aspectClass(aspect):
+    return 10 * (1 + ((aspect + ASPECTBIN / 2) % 360) // ASPECTBIN)
+
+#calculate the slope class codes of an array of slope values
+def slopeClass(slope):
+    return 2 * sum((slope >= brk) * 1 for brk in SLOPEBREAKS)
+
+#store the same class codes as band maths on the aspect (A) and slope (B) rasters
+ASPECTCLASS = '10*(1+((A+{})%360)//{})'.format(ASPECTBIN / 2, ASPECTBIN)
+SLOPECLASS = '2*(' + '+'.join('(B>={})*1'.format(brk) for brk in SLOPEBREAKS) + ')'
+
+#create a class to lazily run the processing stages
+#a stage is only run when asked for, and its result is reused by any later stage
+class StageGraph:
+
+    def __init__(self):
+        self.stages = {}
+        self.results = {}
+
+    #register a stage with the names of the stages it depends on
+    def add(self, name, dependencies, function):
+        self.stages[name] = (dependencies, function)
+
+    #run a stage after running the stages it depends on
+    def get(self, name):
+        if name not in self.results:
+            dependencies, function = self.stages[name]
+            inputs = [self.get(dependency) for dependency in dependencies]
+            self.results[name] = function(*inputs)
+        return self.results[name]
+
+#create a renderer symbolising aspect-slope class codes with the palette for the aspect preference
+def aspectSlopeRenderer(provider, aspectViz):
+
+    #create a function to read the lines of a QGIS colour map file
+    def GetColorRampItemListFromText(file_contents):
+        #remove the header
+        file_contents = file_contents.split('\n')[2:]
+        #split the values by comma for each line and store the values in a list
+        file_contents = [list(map(int,line.split(',')[0:4])) for line in file_contents]
+        #get colour information from each position in the list for each line
+        valueList = [QgsColorRampShader.ColorRampItem(line[0], QColor(line[1],line[2],line[3])) for line in file_contents]
+        return valueList
+    
+    #symoblise final output based on user selection
+    if aspectViz == 0: #no aspect preference, full rainbow colour scheme
+        file_contents = """# QGIS Generated Color Map Export File
+        INTERPOLATION:INTERPOLATED
+        10,181,181,181,255,label
+        12,159,192,133,255,label
+        14,157,221,94,255,label
+        16,154,251,12,255,label
+        18,15,241,57,255,label
+        20,181,181,181,255,label
+        22,114,168,144,255,label
+        24,61,171,113,255,label
+        26,0,173,67,255,label
+        28,0,137,27,255,label
+        30,181,181,181,255,label
+        32,124,142,173,255,label
+        34,80,120,182,255,label
+        36,0,104,192,255,label
+        38,0,86,157,255,label
+        40,181,181,181,255,label
+        42,140,117,160,255,label
+        44,119,71,157,255,label
+        46,108,0,163,255,label
+        48,72,0,140,255,label
+        50,181,181,181,255,label
+        52,180,123,161,255,label
+        54,192,77,156,255,label
+        56,202,0,156,255,label
+        58,154,0,121,255,label
+        60,181,181,181,255,label
+        62,203,139,143,255,label
+        64,231,111,122,255,label
+        66,255,85,104,255,label
+        68,255,51,75,255,label
+        70,181,181,181,255,label
+        72,197,165,138,255,label
+        74,226,166,108,255,label
+        76,255,171,71,255,label
+        78,255,140,8,255,label
+        80,181,181,181,255,label
+        82,189,191,137,255,label
+        84,214,219,94,255,label
+        86,240,244,0,255,label
+        88,255,250,0,255,label"""
+        
+    if aspectViz == 1: #north aspect preference
+        file_contents = """# QGIS Generated Color Map Export File
+        INTERPOLATION:INTERPOLATED
+        10,191,54,12,255,label
+        12,216,67,21,255,label
+        14,230,74,25,255,label
+        16,244,81,30,255,label
+        18,255,87,34,255,label
+        20,33,33,33,255,label
+        22,66,66,66,255,label
+        24,97,97,97,255,label
+        26,117,117,117,255,label
+        28,158,158,158,255,label
+        30,33,33,33,255,label
+        32,66,66,66,255,label
+        34,97,97,97,255,label
+        36,117,117,117,255,label
+        38,158,158,158,255,label
+        40,33,33,33,255,label
+        42,66,66,66,255,label
+        44,97,97,97,255,label
+        46,117,117,117,255,label
+        48,158,158,158,255,label
+        50,33,33,33,255,label
+        52,66,66,66,255,label
+        54,97,97,97,255,label
+        56,117,117,117,255,label
+        58,158,158,158,255,label
+        60,33,33,33,255,label
+        62,66,66,66,255,label
+        64,97,97,97,255,label
+        66,117,117,117,255,label
+        68,158,158,158,255,label
+        70,33,33,33,255,label
+        72,66,66,66,255,label
+        74,97,97,97,255,label
+        76,117,117,117,255,label
+        78,158,158,158,255,label
+        80,33,33,33,255,label
+        82,66,66,66,255,label
+        84,97,97,97,255,label
+        86,117,117,117,255,label
+        88,158,158,158,255,label"""
+        
+    if aspectViz == 2: #north east aspect preference
+        file_contents = """# QGIS Generated Color Map Export File
+        INTERPOLATION:INTERPOLATED
+        10,33,33,33,255,label
+        12,66,66,66,255,label
+        14,97,97,97,255,label
+        16,117,117,117,255,label
+        18,158,158,158,255,label
+        20,191,54,12,255,label
+        22,216,67,21,255,label
+        24,230,74,25,255,label
+        26,244,81,30,255,label
+        28,255,87,34,255,label
+        30,33,33,33,255,label
+        32,66,66,66,255,label
+        34,97,97,97,255,label
+        36,117,117,117,255,label
+        38,158,158,158,255,label
+        40,33,33,33,255,label
+        42,66,66,66,255,label
+        44,97,97,97,255,label
+        46,117,117,117,255,label
+        48,158,158,158,255,label
+        50,33,33,33,255,label
+        52,66,66,66,255,label
+        54,97,97,97,255,label
+        56,117,117,117,255,label
+        58,158,158,158,255,label
+        60,33,33,33,255,label
+        62,66,66,66,255,label
+        64,97,97,97,255,label
+        66,117,117,117,255,label
+        68,158,158,158,255,label
+        70,33,33,33,255,label
+        72,66,66,66,255,label
+        74,97,97,97,255,label
+        76,117,117,117,255,label
+        78,158,158,158,255,label
+        80,33,33,33,255,label
+        82,66,66,66,255,label
+        84,97,97,97,255,label
+        86,117,117,117,255,label
+        88,158,158,158,255,label"""
+        
+    if aspectViz == 3: #east aspect preference
+        file_contents = """# QGIS Generated Color Map Export File
+        INTERPOLATION:INTERPOLATED
+        10,33,33,33,255,label
+        12,66,66,66,255,label
+        14,97,97,97,255,label
+        16,117,117,117,255,label
+        18,158,158,158,255,label
+        20,33,33,33,255,label
+        22,66,66,66,255,label
+        24,97,97,97,255,label
+        26,117,117,117,255,label
+        28,158,158,158,255,label
+        30,191,54,12,255,label
+        32,216,67,21,255,label
+        34,230,74,25,255,label
+        36,244,81,30,255,label
+        38,255,87,34,255,label
+        40,33,33,33,255,label
+        42,66,66,66,255,label
+        44,97,97,97,255,label
+        46,117,117,117,255,label
+        48,158,158,158,255,label
+        50,33,33,33,255,label
+        52,66,66,66,255,label
+        54,97,97,97,255,label
+        56,117,117,117,255,label
+        58,158,158,158,255,label
+        60,33,33,33,255,label
+        62,66,66,66,255,label
+        64,97,97,97,255,label
+        66,117,117,117,255,label
+        68,158,158,158,255,label
+        70,33,33,33,255,label
+        72,66,66,66,255,label
+        74,97,97,97,255,label
+        76,117,117,117,255,label
+        78,158,158,158,255,label
+        80,33,33,33,255,label
+        82,66,66,66,255,label
+        84,97,97,97,255,label
+        86,117,117,117,255,label
+        88,158,158,158,255,label"""
+        
+    if aspectViz == 4: #south east aspect preference
+        file_contents = """# QGIS Generated Color Map Export File
+        INTERPOLATION:INTERPOLATED
+        10,33,33,33,255,label
+        12,66,66,66,255,label
+        14,97,97,97,255,label
+        16,117,117,117,255,label
+        18,158,158,158,255,label
+        20,33,33,33,255,label
+        22,66,66,66,255,label
+        24,97,97,97,255,label
+        26,117,117,117,255,label
+        28,158,158,158,255,label
+        30,33,33,33,255,label
+        32,66,66,66,255,label
+        34,97,97,97,255,label
+        36,117,117,117,255,label
+        38,158,158,158,255,label
+        40,191,54,12,255,label
+        42,216,67,21,255,label
+        44,230,74,25,255,label
+        46,244,81,30,255,label
+        48,255,87,34,255,label
+        50,33,33,33,255,label
+        52,66,66,66,255,label
+        54,97,97,97,255,label
+        56,117,117,117,255,label
+        58,158,158,158,255,label
+        60,33,33,33,255,label
+        62,66,66,66,255,label
+        64,97,97,97,255,label
+        66,117,117,117,255,label
+        68,158,158,158,255,label
+        70,33,33,33,255,label
+        72,66,66,66,255,label
+        74,97,97,97,255,label
+        76,117,117,117,255,label
+        78,158,158,158,255,label
+        80,33,33,33,255,label
+        82,66,66,66,255,label
+        84,97,97,97,255,label
+        86,117,117,117,255,label
+        88,158,158,158,255,label"""
+    
+    if aspectViz == 5: #south aspect preference
+        file_contents = """# QGIS Generated Color Map Export File
+        INTERPOLATION:INTERPOLATED
+        10,33,33,33,255,label
+        12,66,66,66,255,label
+        14,97,97,97,255,label
+        16,117,117,117,255,label
+        18,158,158,158,255,label
+        20,33,33,33,255,label
+        22,66,66,66,255,label
+        24,97,97,97,255,label
+        26,117,117,117,255,label
+        28,158,158,158,255,label
+        30,33,33,33,255,label
+        32,66,66,66,255,label
+        34,97,97,97,255,label
+        36,117,117,117,255,label
+        38,158,158,158,255,label
+        40,33,33,33,255,label
+        42,66,66,66,255,label
+        44,97,97,97,255,label
+        46,117,117,117,255,label
+        48,158,158,158,255,label
+        50,191,54,12,255,label
+        52,216,67,21,255,label
+        54,230,74,25,255,label
+        56,244,81,30,255,label
+        58,255,87,34,255,label
+        60,33,33,33,255,label
+        62,66,66,66,255,label
+        64,97,97,97,255,label
+        66,117,117,117,255,label
+        68,158,158,158,255,label
+        70,33,33,33,255,label
+        72,66,66,66,255,label
+        74,97,97,97,255,label
+        76,117,117,117,255,label
+        78,158,158,158,255,label
+        80,33,33,33,255,label
+        82,66,66,66,255,label
+        84,97,97,97,255,label
+        86,117,117,117,255,label
+        88,158,158,158,255,label"""
+    
+    if aspectViz == 6: #south west aspect preference
+        file_contents = """# QGIS Generated Color Map Export File
+        INTERPOLATION:INTERPOLATED
+        10,33,33,33,255,label
+        12,66,66,66,255,label
+        14,97,97,97,255,label
+        16,117,117,117,255,label
+        18,158,158,158,255,label
+        20,33,33,33,255,label
+        22,66,66,66,255,label
+        24,97,97,97,255,label
+        26,117,117,117,255,label
+        28,158,158,158,255,label
+        30,33,33,33,255,label
+        32,66,66,66,255,label
+        34,97,97,97,255,label
+        36,117,117,117,255,label
+        38,158,158,158,255,label
+        40,33,33,33,255,label
+        42,66,66,66,255,label
+        44,97,97,97,255,label
+        46,117,117,117,255,label
+        48,158,158,158,255,label
+        50,33,33,33,255,label
+        52,66,66,66,255,label
+        54,97,97,97,255,label
+        56,117,117,117,255,label
+        58,158,158,158,255,label
+        60,191,54,12,255,label
+        62,216,67,21,255,label
+        64,230,74,25,255,label
+        66,244,81,30,255,label
+        68,255,87,34,255,label
+        70,33,33,33,255,label
+        72,66,66,66,255,label
+        74,97,97,97,255,label
+        76,117,117,117,255,label
+        78,158,158,158,255,label
+        80,33,33,33,255,label
+        82,66,66,66,255,label
+        84,97,97,97,255,label
+        86,117,117,117,255,label
+        88,158,158,158,255,label"""
+        
+    if aspectViz == 7: #west aspect preference
+        file_contents = """# QGIS Generated Color Map Export File
+        INTERPOLATION:INTERPOLATED
+        10,33,33,33,255,label
+        12,66,66,66,255,label
+        14,97,97,97,255,label
+        16,117,117,117,255,label
+        18,158,158,158,255,label
+        20,33,33,33,255,label
+        22,66,66,66,255,label
+        24,97,97,97,255,label
+        26,117,117,117,255,label
+        28,158,158,158,255,label
+        30,33,33,33,255,label
+        32,66,66,66,255,label
+        34,97,97,97,255,label
+        36,117,117,117,255,label
+        38,158,158,158,255,label
+        40,33,33,33,255,label
+        42,66,66,66,255,label
+        44,97,97,97,255,label
+        46,117,117,117,255,label
+        48,158,158,158,255,label
+        50,33,33,33,255,label
+        52,66,66,66,255,label
+        54,97,97,97,255,label
+        56,117,117,117,255,label
+        58,158,158,158,255,label
+        60,33,33,33,255,label
+        62,66,66,66,255,label
+        64,97,97,97,255,label
+        66,117,117,117,255,label
+        68,158,158,158,255,label
+        70,191,54,12,255,label
+        72,216,67,21,255,label
+        74,230,74,25,255,label
+        76,244,81,30,255,label
+        78,255,87,34,255,label
+        80,33,33,33,255,label
+        82,66,66,66,255,label
+        84,97,97,97,255,label
+        86,117,117,117,255,label
+        88,158,158,158,255,label"""
+        
+    if aspectViz == 8: #north west aspect preference
+        file_contents = """# QGIS Generated Color Map Export File
+        INTERPOLATION:INTERPOLATED
+        10,33,33,33,255,label
+        12,66,66,66,255,label
+        14,97,97,97,255,label
+        16,117,117,117,255,label
+        18,158,158,158,255,label
+        20,33,33,33,255,label
+        22,66,66,66,255,label
+        24,97,97,97,255,label
+        26,117,117,117,255,label
+        28,158,158,158,255,label
+        30,33,33,33,255,label
+        32,66,66,66,255,label
+        34,97,97,97,255,label
+        36,117,117,117,255,label
+        38,158,158,158,255,label
+        40,33,33,33,255,label
+        42,66,66,66,255,label
+        44,97,97,97,255,label
+        46,117,117,117,255,label
+        48,158,158,158,255,label
+        50,33,33,33,255,label
+        52,66,66,66,255,label
+        54,97,97,97,255,label
+        56,117,117,117,255,label
+        58,158,158,158,255,label
+        60,33,33,33,255,label
+        62,66,66,66,255,label
+        64,97,97,97,255,label
+        66,117,117,117,255,label
+        68,158,158,158,255,label
+        70,33,33,33,255,label
+        72,66,66,66,255,label
+        74,97,97,97,255,label
+        76,117,117,117,255,label
+        78,158,158,158,255,label
+        80,191,54,12,255,label
+        82,216,67,21,255,label
+        84,230,74,25,255,label
+        86,244,81,30,255,label
+        88,255,87,34,255,label"""
+
+    #update the list from the file contents
+    valueList = GetColorRampItemListFromText(file_contents)
+
+    #set the colour ramp type to interpolated
+    colRamp = QgsColorRampShader()
+    colRamp.setColorRampType(QgsColorRampShader.Interpolated)
+
+    #update the colour ramp with the values list
+    colRamp.setColorRampItemList(valueList)
+
+    #define the shader
+    shader = QgsRasterShader()
+    shader.setRasterShaderFunction(colRamp)
+
+    #define the render
+    renderer = QgsSingleBandPseudoColorRenderer(provider, 1, shader)
+
+    #set min and max values
+    renderer.setClassificationMin(10)
+    renderer.setClassificationMax(88)
+    return renderer
+
+#store numpy types for reading DEM blocks of each QGIS data type
+NUMPYTYPES = {Qgis.Byte : numpy.uint8,
+              Qgis.UInt16 : numpy.uint16,
+              Qgis.Int16 : numpy.int16,
+              Qgis.UInt32 : numpy.uint32,
+              Qgis.Int32 : numpy.int32,
+              Qgis.Float32 : numpy.float32,
+              Qgis.Float64 : numpy.float64}
+
+#store recently computed class tiles, shared by every copy of the dynamic provider
+#as QGIS clones the provider for each map render
+TILESIZE = 256
+TILECACHESIZE = 256
+tileCache = OrderedDict()
+tileCacheLock = threading.Lock()
+
+#create a raster data provider computing aspect-slope class codes on the fly
+#QGIS asks it for blocks matching the visible map extent and the resolution of the current zoom
+class AspectSlopeProvider(QgsRasterDataProvider):
+
+    def __init__(self, uri='', providerOptions=None, flags=None):
+        if providerOptions is None:
+            providerOptions = QgsDataProvider.ProviderOptions()
+        if flags is None:
+            flags = QgsDataProvider.ReadFlags()
+        super().__init__(uri, providerOptions, flags)
+        #keep the options so clones open the DEM the same way
+        self.options = providerOptions
+        #read the DEM source and slope z factor from the layer uri
+        params = dict(parse_qsl(uri))
+        self.zFactor = float(params.get('zfactor', 1))
+        self.demProvider = QgsProviderRegistry.instance().createProvider(
+            params.get('provider', 'gdal'),
+            params.get('dem', ''),
+            providerOptions
+        )
+
+    @classmethod
+    def providerKey(cls):
+        return 'aspectslope'
+
+    @classmethod
+    def description(cls):
+        return 'Aspect-Slope dynamic layer'
+
+    @classmethod
+    def createProvider(cls, uri, providerOptions, flags=None):
+        return AspectSlopeProvider(uri, providerOptions, flags)
+
+    def name(self):
+        return self.providerKey()
+
+    def clone(self):
+        return AspectSlopeProvider(self.dataSourceUri(), self.options)
+
+    def isValid(self):
+        return self.demProvider is not None and self.demProvider.isValid()
+
+    def capabilities(self):
+        return QgsRasterInterface.Size
+
+    def crs(self):
+        return self.demProvider.crs()
+
+    def extent(self):
+        return self.demProvider.extent()
+
+    def xSize(self):
+        return self.demProvider.xSize()
+
+    def ySize(self):
+        return self.demProvider.ySize()
+
+    def bandCount(self):
+        return 1
+
+    def generateBandName(self, bandNo):
+        return 'Aspect-Slope'
+
+    def dataType(self, bandNo):
+        return Qgis.Byte
+
+    def sourceDataType(self, bandNo):
+        return Qgis.Byte
+
+    def sourceHasNoDataValue(self, bandNo):
+        return True
+
+    def sourceNoDataValue(self, bandNo):
+        return 0
+
+    def block(self, bandNo, extent, width, height, feedback=None):
+        demExtent = self.demProvider.extent()
+        viewX = extent.width() / width
+        viewY = extent.height() / height
+        nativeX = demExtent.width() / self.demProvider.xSize()
+        nativeY = demExtent.height() / self.demProvider.ySize()
+
+        #pick the zoom level with cells no coarser than the view cells
+        #but never finer than the DEM cells, as upsampled DEM cells read as flat
+        level = max(0, int(math.floor(math.log2(viewX / nativeX))))
+        cellX = nativeX * 2 ** level
+        cellY = nativeY * 2 ** level
+        tileX = TILESIZE * cellX
+        tileY = TILESIZE * cellY
+
+        #create the output block of class codes, no data outside the DEM
+        output = numpy.zeros((height, width), dtype=numpy.uint8)
+        view = extent.intersect(demExtent)
+        if not view.isEmpty():
+            #find the tiles of this zoom level covering the view
+            lastCol = int(math.ceil(demExtent.width() / tileX)) - 1
+            lastRow = int(math.ceil(demExtent.height() / tileY)) - 1
+            firstCol = min(lastCol, int((view.xMinimum() - demExtent.xMinimum()) // tileX))
+            firstRow = min(lastRow, int((demExtent.yMaximum() - view.yMaximum()) // tileY))
+            lastCol = min(lastCol, int((view.xMaximum() - demExtent.xMinimum()) // tileX))
+            lastRow = min(lastRow, int((demExtent.yMaximum() - view.yMinimum()) // tileY))
+
+            #assemble the tiles into one mosaic
+            mosaic = numpy.zeros(((lastRow - firstRow + 1) * TILESIZE, (lastCol - firstCol + 1) * TILESIZE), dtype=numpy.uint8)
+            for row in range(firstRow, lastRow + 1):
+                for col in range(firstCol, lastCol + 1):
+                    tile = self.tile(level, col, row, cellX, cellY, feedback)
+                    if tile is None:
+                        return QgsRasterBlock()
+                    top = (row - firstRow) * TILESIZE
+                    left = (col - firstCol) * TILESIZE
+                    mosaic[top:top + TILESIZE, left:left + TILESIZE] = tile
+
+            #resample the mosaic to the view cells (nearest neighbour)
+            mosaicX = demExtent.xMinimum() + firstCol * tileX
+            mosaicY = demExtent.yMaximum() - firstRow * tileY
+            cols = numpy.floor((extent.xMinimum() + (numpy.arange(width) + 0.5) * viewX - mosaicX) / cellX).astype(int)
+            rows = numpy.floor((mosaicY - extent.yMaximum() + (numpy.arange(height) + 0.5) * viewY) / cellY).astype(int)
+            validCols = (cols >= 0) & (cols < mosaic.shape[1])
+            validRows = (rows >= 0) & (rows < mosaic.shape[0])
+            output[numpy.ix_(validRows, validCols)] = mosaic[numpy.ix_(rows[validRows], cols[validCols])]
+
+        block = QgsRasterBlock(Qgis.Byte, width, height)
+        block.setData(QByteArray(output.tobytes()))
+        block.setNoDataValue(0)
+        return block
+
+    def tile(self, level, col, row, cellX, cellY, feedback):
+        #reuse the class codes if this tile has been computed recently
+        key = (self.dataSourceUri(), level, col, row)
+        with tileCacheLock:
+            classes = tileCache.get(key)
+            if classes is not None:
+                tileCache.move_to_end(key)
+                return classes
+
+        demExtent = self.demProvider.extent()
+        xMin = demExtent.xMinimum() + col * TILESIZE * cellX
+        yMax = demExtent.yMaximum() - row * TILESIZE * cellY
+        tileExtent = QgsRectangle(xMin, yMax - TILESIZE * cellY, xMin + TILESIZE * cellX, yMax)
+        classes = self.computeClasses(tileExtent, TILESIZE, TILESIZE, feedback)
+        if classes is not None:
+            with tileCacheLock:
+                tileCache[key] = classes
+                #drop the least recently viewed tiles
+                while len(tileCache) > TILECACHESIZE:
+                    tileCache.popitem(last=False)
+        return classes
+
+    def computeClasses(self, extent, width, height, feedback):
+        cellX = extent.width() / width
+        cellY = extent.height() / height
+        #read the DEM one cell beyond the tile so edge cells have neighbours
+        #reading at the tile resolution lets the DEM provider use a matching overview
+        padded = QgsRectangle(extent.xMinimum() - cellX, extent.yMinimum() - cellY,
+                              extent.xMaximum() + cellX, extent.yMaximum() + cellY)
+        demBlock = self.demProvider.block(1, padded, width + 2, height + 2, feedback)
+        if not demBlock.isValid() or demBlock.dataType() not in NUMPYTYPES:
+            return None
+        dem = numpy.frombuffer(bytes(demBlock.data()), dtype=NUMPYTYPES[demBlock.dataType()])
+        dem = dem.reshape(height + 2, width + 2).astype(numpy.float64)
+
+        #mask DEM no data
+        if demBlock.hasNoDataValue():
+            dem[dem == demBlock.noDataValue()] = numpy.nan
+        #mask the columns and rows falling outside the DEM extent
+        demExtent = self.demProvider.extent()
+        xs = padded.xMinimum() + (numpy.arange(width + 2) + 0.5) * cellX
+        ys = padded.yMaximum() - (numpy.arange(height + 2) + 0.5) * cellY
+        dem[:, (xs < demExtent.xMinimum()) | (xs > demExtent.xMaximum())] = numpy.nan
+        dem[(ys < demExtent.yMinimum()) | (ys > demExtent.yMaximum()), :] = numpy.nan
+
+        #calculate the surface gradient from the neighbouring cells (Horn's method)
+        a, b, c = dem[:-2, :-2], dem[:-2, 1:-1], dem[:-2, 2:]
+        d, f = dem[1:-1, :-2], dem[1:-1, 2:]
+        g, h, i = dem[2:, :-2], dem[2:, 1:-1], dem[2:, 2:]
+        dzdx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * cellX)
+        dzdy = ((a + 2 * b + c) - (g + 2 * h + i)) / (8 * cellY)
+
+        with numpy.errstate(invalid='ignore'):
+            #downslope direction clockwise from north, and steepness in degrees
+            aspect = numpy.degrees(numpy.arctan2(-dzdx, -dzdy)) % 360
+            slope = numpy.degrees(numpy.arctan(self.zFactor * numpy.hypot(dzdx, dzdy)))
+            classes = aspectClass(aspect) + slopeClass(slope)
+
+        #flat cells have no aspect, so are set to no data like the aspect tool
+        noData = numpy.isnan(dzdx) | numpy.isnan(dzdy) | ((dzdx == 0) & (dzdy == 0))
+        return numpy.where(noData, 0, classes).astype(numpy.uint8)
+
+#register the dynamic provider with QGIS the first time it is needed
+def registerAspectSlopeProvider():
+    registry = QgsProviderRegistry.instance()
+    if AspectSlopeProvider.providerKey() not in registry.providerList():
+        metadata = QgsProviderMetadata(
+            AspectSlopeProvider.providerKey(),
+            AspectSlopeProvider.description(),
+            AspectSlopeProvider.createProvider
+        )
+        registry.registerProvider(metadata)
 
 #create class to store both the GUI and processing tool code
 class AspectSlopeMapping(QgsProcessingAlgorithm):
@@ -21,6 +711,7 @@ class AspectSlopeMapping(QgsProcessingAlgorithm):
     ASPECTZ = 'ASPECTZ'
     SLOPEYN = 'SLOPEYN'
     SLOPEZ = 'SLOPEZ'
+    MODE = 'MODE'
     OUTPUT = 'OUTPUT'
 
     #descriptors of the processing tool
@@ -46,7 +737,8 @@ class AspectSlopeMapping(QgsProcessingAlgorithm):
         return self.tr("All-in-one aspect-slope mapping and visualisation tool. \
                        Select your favoured aspect to highlight in the final visualisation output. \
                        A selection of no preference will use a default full spectrum colour scheme.\
-                       Also choose whether you would like an aspect and/or slope map intermediate output as well.")
+                       Also choose whether you would like an aspect and/or slope map intermediate output as well.\
+                       The dynamic layer mode skips the batch run and computes the aspect-slope classes for the visible map extent only.")
 
     def initAlgorithm(self, config=None):
         
@@ -101,6 +793,15 @@ class AspectSlopeMapping(QgsProcessingAlgorithm):
                 defaultValue = 1
             )
         )
+        #define the output mode choice
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.MODE,
+                self.tr('Select the output mode (a dynamic layer is computed for the visible map extent and ignores the aspect and slope map choices)'),
+                options = [('Full resolution output'), ('Dynamic layer')],
+                defaultValue = 0
+            )
+        )
         #define feature sink
         self.addParameter(
             QgsProcessingParameterFeatureSink(
@@ -152,75 +853,13 @@ class AspectSlopeMapping(QgsProcessingAlgorithm):
             self.SLOPEZ,
             context
         )
+        #define output mode parameter
+        mode = self.parameterAsDouble(
+            parameters,
+            self.MODE,
+            context
+        )
         
-        #store aspect function parameters
-        aspectDict = {'INPUT' : rasterSource,
-                      'Z_FACTOR' : aspectZ,
-                      'OUTPUT' : 'TEMPORARY_OUTPUT'}
-        #run aspect processing tool and load results
-        aspect = processing.run("qgis:aspect", aspectDict, context=context, feedback=feedback)
-        #create output layer
-        aspectLayer = QgsRasterLayer(aspect['OUTPUT'], 'Aspect')
-        #add to map if user selected yes to parameter
-        if aspectYN == 0:
-            QgsProject.instance().addMapLayer(aspectLayer)
-
-        #store slope function parameters
-        slopeDict = {'INPUT' : rasterSource, 
-                     'Z_FACTOR' : slopeZ,
-                     'OUTPUT' : 'TEMPORARY_OUTPUT'}
-        #run slope processing tool and load results
-        slope = processing.run("qgis:slope", slopeDict, context=context, feedback=feedback)
-        #create output layer
-        slopeLayer = QgsRasterLayer(slope['OUTPUT'], 'Slope')
-        #add to map if user selected yes to parameter
-        if slopeYN == 0:
-            QgsProject.instance().addMapLayer(slopeLayer)
-        
-        #store aspect reclassification values based on cardinal directions
-        aspectTable =  ['0','22.499','10',
-                        '22.5','67.499','20',
-                        '67.5','112.499','30',
-                        '112.5','157.499','40',
-                        '157.5','202.499','50',
-                        '202.5','247.499','60',
-                        '247.5','292.499','70',
-                        '292.5','337.499','80',
-                        '337.5','360.5','10']
-        #store aspect reclassification function parameters
-        aspectReclassDict = {'INPUT_RASTER' : aspectLayer,
-                             'RASTER_BAND' : 1,
-                             'TABLE' : aspectTable,
-                             'NO_DATA' : -9999,
-                             'RANGE_BOUNDARIES' : 0,
-                             'NODATA_FOR_MISSING' : False,
-                             'DATA_TYPE' : 5,
-                             'OUTPUT' : 'TEMPORARY_OUTPUT'}
-        #run reclassify by table tool and load results
-        aspectReclass = processing.run("qgis:reclassifybytable", aspectReclassDict, context=context, feedback=feedback)
-        #create output layer
-        aspectReclassLayer = QgsRasterLayer(aspectReclass['OUTPUT'], 'Aspect Reclass')
-        
-        #store slope reclassification values
-        slopeTable = ['0','4.999','0',
-                      '5','14.999','2',
-                      '15','29.999','4',
-                      '30','44.999','6',
-                      '45','90.0','8']
-        #store slope reclassification function parameters
-        slopeReclassDict = {'INPUT_RASTER' : slopeLayer,
-                             'RASTER_BAND' : 1,
-                             'TABLE' : slopeTable,
-                             'NO_DATA' : -9999,
-                             'RANGE_BOUNDARIES' : 0,
-                             'NODATA_FOR_MISSING' : False,
-                             'DATA_TYPE' : 5,
-                             'OUTPUT' : 'TEMPORARY_OUTPUT'}
-        #run reclassify by table tool and load results
-        slopeReclass = processing.run("qgis:reclassifybytable", slopeReclassDict, context=context, feedback=feedback)
-        #create output layer
-        slopeReclassLayer = QgsRasterLayer(slopeReclass['OUTPUT'], 'Slope Reclass')
-
         #get user's aspect preference
         if aspectViz == 0:
             label = 'Visualised'
@@ -240,454 +879,80 @@ class AspectSlopeMapping(QgsProcessingAlgorithm):
             label = 'West'
         if aspectViz == 8:
             label = 'North West'
-        
-        #use raster calculator addition to add both reclassed layers together
-        rasterAddDict = {'INPUT_A' : aspectReclassLayer,
-                         'BAND_A' : 1,
-                         'INPUT_B' : slopeReclassLayer,
-                         'BAND_B' : 1,
-                         'FORMULA' : ('A+B'),
-                         'NO_DATA' : 0,
+
+        #add a layer computing the classes on the fly for the visible map extent
+        if mode == 1:
+            registerAspectSlopeProvider()
+            uri = urlencode({'dem' : rasterSource.source(),
+                             'provider' : rasterSource.providerType(),
+                             'zfactor' : slopeZ})
+            dynamicLayer = QgsRasterLayer(uri, ('Aspect-Slope -' + str(label) + ' (Dynamic)'), AspectSlopeProvider.providerKey())
+            dynamicLayer.setRenderer(aspectSlopeRenderer(dynamicLayer.dataProvider(), aspectViz))
+            QgsProject.instance().addMapLayer(dynamicLayer)
+            return {}
+
+        #build the processing stages as a lazy graph so that only the
+        #stages the requested outputs depend on are run
+        graph = StageGraph()
+
+        #the DEM both terrain filters derive their surface gradient from
+        def gradientStage():
+            return rasterSource
+
+        #run aspect processing tool, keeping only the output path
+        def aspectStage(dem):
+            aspectDict = {'INPUT' : dem,
+                          'Z_FACTOR' : aspectZ,
+                          'OUTPUT' : 'TEMPORARY_OUTPUT'}
+            return processing.run("qgis:aspect", aspectDict, context=context, feedback=feedback)['OUTPUT']
+
+        #run slope processing tool, keeping only the output path
+        def slopeStage(dem):
+            slopeDict = {'INPUT' : dem,
+                         'Z_FACTOR' : slopeZ,
                          'OUTPUT' : 'TEMPORARY_OUTPUT'}
-        #run raster calculator tool and load results
-        rasterAdd = processing.run("gdal:rastercalculator", rasterAddDict, context=context, feedback=feedback)
-        #create output layer labelled with aspect preference
-        rasterAddLayer = QgsRasterLayer(rasterAdd['OUTPUT'], ('Aspect-Slope -' + str(label)))
-        #add to map
-        QgsProject.instance().addMapLayer(rasterAddLayer)
-        
-        #begin visualisation process
-        
-        #create a function to read the lines of a QGIS colour map file
-        def GetColorRampItemListFromText(file_contents):
-            #remove the header
-            file_contents = file_contents.split('\n')[2:]
-            #split the values by comma for each line and store the values in a list
-            file_contents = [list(map(int,line.split(',')[0:4])) for line in file_contents]
-            #get colour information from each position in the list for each line
-            valueList = [QgsColorRampShader.ColorRampItem(line[0], QColor(line[1],line[2],line[3])) for line in file_contents]
-            return valueList
-        
-        #symoblise final output based on user selection
-        if aspectViz == 0: #no aspect preference, full rainbow colour scheme
-            file_contents = """# QGIS Generated Color Map Export File
-            INTERPOLATION:INTERPOLATED
-            10,181,181,181,255,label
-            12,159,192,133,255,label
-            14,157,221,94,255,label
-            16,154,251,12,255,label
-            18,15,241,57,255,label
-            20,181,181,181,255,label
-            22,114,168,144,255,label
-            24,61,171,113,255,label
-            26,0,173,67,255,label
-            28,0,137,27,255,label
-            30,181,181,181,255,label
-            32,124,142,173,255,label
-            34,80,120,182,255,label
-            36,0,104,192,255,label
-            38,0,86,157,255,label
-            40,181,181,181,255,label
-            42,140,117,160,255,label
-            44,119,71,157,255,label
-            46,108,0,163,255,label
-            48,72,0,140,255,label
-            50,181,181,181,255,label
-            52,180,123,161,255,label
-            54,192,77,156,255,label
-            56,202,0,156,255,label
-            58,154,0,121,255,label
-            60,181,181,181,255,label
-            62,203,139,143,255,label
-            64,231,111,122,255,label
-            66,255,85,104,255,label
-            68,255,51,75,255,label
-            70,181,181,181,255,label
-            72,197,165,138,255,label
-            74,226,166,108,255,label
-            76,255,171,71,255,label
-            78,255,140,8,255,label
-            80,181,181,181,255,label
-            82,189,191,137,255,label
-            84,214,219,94,255,label
-            86,240,244,0,255,label
-            88,255,250,0,255,label"""
-            
-        if aspectViz == 1: #north aspect preference
-            file_contents = """# QGIS Generated Color Map Export File
-            INTERPOLATION:INTERPOLATED
-            10,191,54,12,255,label
-            12,216,67,21,255,label
-            14,230,74,25,255,label
-            16,244,81,30,255,label
-            18,255,87,34,255,label
-            20,33,33,33,255,label
-            22,66,66,66,255,label
-            24,97,97,97,255,label
-            26,117,117,117,255,label
-            28,158,158,158,255,label
-            30,33,33,33,255,label
-            32,66,66,66,255,label
-            34,97,97,97,255,label
-            36,117,117,117,255,label
-            38,158,158,158,255,label
-            40,33,33,33,255,label
-            42,66,66,66,255,label
-            44,97,97,97,255,label
-            46,117,117,117,255,label
-            48,158,158,158,255,label
-            50,33,33,33,255,label
-            52,66,66,66,255,label
-            54,97,97,97,255,label
-            56,117,117,117,255,label
-            58,158,158,158,255,label
-            60,33,33,33,255,label
-            62,66,66,66,255,label
-            64,97,97,97,255,label
-            66,117,117,117,255,label
-            68,158,158,158,255,label
-            70,33,33,33,255,label
-            72,66,66,66,255,label
-            74,97,97,97,255,label
-            76,117,117,117,255,label
-            78,158,158,158,255,label
-            80,33,33,33,255,label
-            82,66,66,66,255,label
-            84,97,97,97,255,label
-            86,117,117,117,255,label
-            88,158,158,158,255,label"""
-            
-        if aspectViz == 2: #north east aspect preference
-            file_contents = """# QGIS Generated Color Map Export File
-            INTERPOLATION:INTERPOLATED
-            10,33,33,33,255,label
-            12,66,66,66,255,label
-            14,97,97,97,255,label
-            16,117,117,117,255,label
-            18,158,158,158,255,label
-            20,191,54,12,255,label
-            22,216,67,21,255,label
-            24,230,74,25,255,label
-            26,244,81,30,255,label
-            28,255,87,34,255,label
-            30,33,33,33,255,label
-            32,66,66,66,255,label
-            34,97,97,97,255,label
-            36,117,117,117,255,label
-            38,158,158,158,255,label
-            40,33,33,33,255,label
-            42,66,66,66,255,label
-            44,97,97,97,255,label
-            46,117,117,117,255,label
-            48,158,158,158,255,label
-            50,33,33,33,255,label
-            52,66,66,66,255,label
-            54,97,97,97,255,label
-            56,117,117,117,255,label
-            58,158,158,158,255,label
-            60,33,33,33,255,label
-            62,66,66,66,255,label
-            64,97,97,97,255,label
-            66,117,117,117,255,label
-            68,158,158,158,255,label
-            70,33,33,33,255,label
-            72,66,66,66,255,label
-            74,97,97,97,255,label
-            76,117,117,117,255,label
-            78,158,158,158,255,label
-            80,33,33,33,255,label
-            82,66,66,66,255,label
-            84,97,97,97,255,label
-            86,117,117,117,255,label
-            88,158,158,158,255,label"""
-            
-        if aspectViz == 3: #east aspect preference
-            file_contents = """# QGIS Generated Color Map Export File
-            INTERPOLATION:INTERPOLATED
-            10,33,33,33,255,label
-            12,66,66,66,255,label
-            14,97,97,97,255,label
-            16,117,117,117,255,label
-            18,158,158,158,255,label
-            20,33,33,33,255,label
-            22,66,66,66,255,label
-            24,97,97,97,255,label
-            26,117,117,117,255,label
-            28,158,158,158,255,label
-            30,191,54,12,255,label
-            32,216,67,21,255,label
-            34,230,74,25,255,label
-            36,244,81,30,255,label
-            38,255,87,34,255,label
-            40,33,33,33,255,label
-            42,66,66,66,255,label
-            44,97,97,97,255,label
-            46,117,117,117,255,label
-            48,158,158,158,255,label
-            50,33,33,33,255,label
-            52,66,66,66,255,label
-            54,97,97,97,255,label
-            56,117,117,117,255,label
-            58,158,158,158,255,label
-            60,33,33,33,255,label
-            62,66,66,66,255,label
-            64,97,97,97,255,label
-            66,117,117,117,255,label
-            68,158,158,158,255,label
-            70,33,33,33,255,label
-            72,66,66,66,255,label
-            74,97,97,97,255,label
-            76,117,117,117,255,label
-            78,158,158,158,255,label
-            80,33,33,33,255,label
-            82,66,66,66,255,label
-            84,97,97,97,255,label
-            86,117,117,117,255,label
-            88,158,158,158,255,label"""
-            
-        if aspectViz == 4: #south east aspect preference
-            file_contents = """# QGIS Generated Color Map Export File
-            INTERPOLATION:INTERPOLATED
-            10,33,33,33,255,label
-            12,66,66,66,255,label
-            14,97,97,97,255,label
-            16,117,117,117,255,label
-            18,158,158,158,255,label
-            20,33,33,33,255,label
-            22,66,66,66,255,label
-            24,97,97,97,255,label
-            26,117,117,117,255,label
-            28,158,158,158,255,label
-            30,33,33,33,255,label
-            32,66,66,66,255,label
-            34,97,97,97,255,label
-            36,117,117,117,255,label
-            38,158,158,158,255,label
-            40,191,54,12,255,label
-            42,216,67,21,255,label
-            44,230,74,25,255,label
-            46,244,81,30,255,label
-            48,255,87,34,255,label
-            50,33,33,33,255,label
-            52,66,66,66,255,label
-            54,97,97,97,255,label
-            56,117,117,117,255,label
-            58,158,158,158,255,label
-            60,33,33,33,255,label
-            62,66,66,66,255,label
-            64,97,97,97,255,label
-            66,117,117,117,255,label
-            68,158,158,158,255,label
-            70,33,33,33,255,label
-            72,66,66,66,255,label
-            74,97,97,97,255,label
-            76,117,117,117,255,label
-            78,158,158,158,255,label
-            80,33,33,33,255,label
-            82,66,66,66,255,label
-            84,97,97,97,255,label
-            86,117,117,117,255,label
-            88,158,158,158,255,label"""
-        
-        if aspectViz == 5: #south aspect preference
-            file_contents = """# QGIS Generated Color Map Export File
-            INTERPOLATION:INTERPOLATED
-            10,33,33,33,255,label
-            12,66,66,66,255,label
-            14,97,97,97,255,label
-            16,117,117,117,255,label
-            18,158,158,158,255,label
-            20,33,33,33,255,label
-            22,66,66,66,255,label
-            24,97,97,97,255,label
-            26,117,117,117,255,label
-            28,158,158,158,255,label
-            30,33,33,33,255,label
-            32,66,66,66,255,label
-            34,97,97,97,255,label
-            36,117,117,117,255,label
-            38,158,158,158,255,label
-            40,33,33,33,255,label
-            42,66,66,66,255,label
-            44,97,97,97,255,label
-            46,117,117,117,255,label
-            48,158,158,158,255,label
-            50,191,54,12,255,label
-            52,216,67,21,255,label
-            54,230,74,25,255,label
-            56,244,81,30,255,label
-            58,255,87,34,255,label
-            60,33,33,33,255,label
-            62,66,66,66,255,label
-            64,97,97,97,255,label
-            66,117,117,117,255,label
-            68,158,158,158,255,label
-            70,33,33,33,255,label
-            72,66,66,66,255,label
-            74,97,97,97,255,label
-            76,117,117,117,255,label
-            78,158,158,158,255,label
-            80,33,33,33,255,label
-            82,66,66,66,255,label
-            84,97,97,97,255,label
-            86,117,117,117,255,label
-            88,158,158,158,255,label"""
-        
-        if aspectViz == 6: #south west aspect preference
-            file_contents = """# QGIS Generated Color Map Export File
-            INTERPOLATION:INTERPOLATED
-            10,33,33,33,255,label
-            12,66,66,66,255,label
-            14,97,97,97,255,label
-            16,117,117,117,255,label
-            18,158,158,158,255,label
-            20,33,33,33,255,label
-            22,66,66,66,255,label
-            24,97,97,97,255,label
-            26,117,117,117,255,label
-            28,158,158,158,255,label
-            30,33,33,33,255,label
-            32,66,66,66,255,label
-            34,97,97,97,255,label
-            36,117,117,117,255,label
-            38,158,158,158,255,label
-            40,33,33,33,255,label
-            42,66,66,66,255,label
-            44,97,97,97,255,label
-            46,117,117,117,255,label
-            48,158,158,158,255,label
-            50,33,33,33,255,label
-            52,66,66,66,255,label
-            54,97,97,97,255,label
-            56,117,117,117,255,label
-            58,158,158,158,255,label
-            60,191,54,12,255,label
-            62,216,67,21,255,label
-            64,230,74,25,255,label
-            66,244,81,30,255,label
-            68,255,87,34,255,label
-            70,33,33,33,255,label
-            72,66,66,66,255,label
-            74,97,97,97,255,label
-            76,117,117,117,255,label
-            78,158,158,158,255,label
-            80,33,33,33,255,label
-            82,66,66,66,255,label
-            84,97,97,97,255,label
-            86,117,117,117,255,label
-            88,158,158,158,255,label"""
-            
-        if aspectViz == 7: #west aspect preference
-            file_contents = """# QGIS Generated Color Map Export File
-            INTERPOLATION:INTERPOLATED
-            10,33,33,33,255,label
-            12,66,66,66,255,label
-            14,97,97,97,255,label
-            16,117,117,117,255,label
-            18,158,158,158,255,label
-            20,33,33,33,255,label
-            22,66,66,66,255,label
-            24,97,97,97,255,label
-            26,117,117,117,255,label
-            28,158,158,158,255,label
-            30,33,33,33,255,label
-            32,66,66,66,255,label
-            34,97,97,97,255,label
-            36,117,117,117,255,label
-            38,158,158,158,255,label
-            40,33,33,33,255,label
-            42,66,66,66,255,label
-            44,97,97,97,255,label
-            46,117,117,117,255,label
-            48,158,158,158,255,label
-            50,33,33,33,255,label
-            52,66,66,66,255,label
-            54,97,97,97,255,label
-            56,117,117,117,255,label
-            58,158,158,158,255,label
-            60,33,33,33,255,label
-            62,66,66,66,255,label
-            64,97,97,97,255,label
-            66,117,117,117,255,label
-            68,158,158,158,255,label
-            70,191,54,12,255,label
-            72,216,67,21,255,label
-            74,230,74,25,255,label
-            76,244,81,30,255,label
-            78,255,87,34,255,label
-            80,33,33,33,255,label
-            82,66,66,66,255,label
-            84,97,97,97,255,label
-            86,117,117,117,255,label
-            88,158,158,158,255,label"""
-            
-        if aspectViz == 8: #north west aspect preference
-            file_contents = """# QGIS Generated Color Map Export File
-            INTERPOLATION:INTERPOLATED
-            10,33,33,33,255,label
-            12,66,66,66,255,label
-            14,97,97,97,255,label
-            16,117,117,117,255,label
-            18,158,158,158,255,label
-            20,33,33,33,255,label
-            22,66,66,66,255,label
-            24,97,97,97,255,label
-            26,117,117,117,255,label
-            28,158,158,158,255,label
-            30,33,33,33,255,label
-            32,66,66,66,255,label
-            34,97,97,97,255,label
-            36,117,117,117,255,label
-            38,158,158,158,255,label
-            40,33,33,33,255,label
-            42,66,66,66,255,label
-            44,97,97,97,255,label
-            46,117,117,117,255,label
-            48,158,158,158,255,label
-            50,33,33,33,255,label
-            52,66,66,66,255,label
-            54,97,97,97,255,label
-            56,117,117,117,255,label
-            58,158,158,158,255,label
-            60,33,33,33,255,label
-            62,66,66,66,255,label
-            64,97,97,97,255,label
-            66,117,117,117,255,label
-            68,158,158,158,255,label
-            70,33,33,33,255,label
-            72,66,66,66,255,label
-            74,97,97,97,255,label
-            76,117,117,117,255,label
-            78,158,158,158,255,label
-            80,191,54,12,255,label
-            82,216,67,21,255,label
-            84,230,74,25,255,label
-            86,244,81,30,255,label
-            88,255,87,34,255,label"""
-       
-        #update the list from the file contents
-        valueList = GetColorRampItemListFromText(file_contents)
-        
-        #set the colour ramp type to interpolated
-        colRamp = QgsColorRampShader()
-        colRamp.setColorRampType(QgsColorRampShader.Interpolated)
-        
-        #update the colour ramp with the values list
-        colRamp.setColorRampItemList(valueList)
-        
-        #define the shader
-        shader = QgsRasterShader()
-        shader.setRasterShaderFunction(colRamp)
-        
-        #define and apply the render
-        renderer = QgsSingleBandPseudoColorRenderer(rasterAddLayer.dataProvider(), 1, shader)
-        
-        #set min and max values
-        renderer.setClassificationMin(10)
-        renderer.setClassificationMax(88)
-        
-        #set renderer and refresh the layer
-        rasterAddLayer.setRenderer(renderer)
-        rasterAddLayer.triggerRepaint()
-        
+            return processing.run("qgis:slope", slopeDict, context=context, feedback=feedback)['OUTPUT']
+
+        #describe the aspect and slope classes as band maths on the derivatives
+        #nothing is written here, the classes are evaluated within the combine stage
+        def classesStage(aspectPath, slopePath):
+            return {'INPUT_A' : aspectPath,
+                    'BAND_A' : 1,
+                    'INPUT_B' : slopePath,
+                    'BAND_B' : 1,
+                    'FORMULA' : ASPECTCLASS + '+' + SLOPECLASS}
+
+        #use raster calculator to classify and add both layers together in one pass
+        #class codes range from 10 to 88 so the output is stored as bytes
+        def combineStage(classes):
+            rasterAddDict = dict(classes)
+            rasterAddDict.update({'NO_DATA' : 0,
+                                  'RTYPE' : 0,
+                                  'OUTPUT' : 'TEMPORARY_OUTPUT'})
+            rasterAdd = processing.run("gdal:rastercalculator", rasterAddDict, context=context, feedback=feedback)
+            #create output layer labelled with aspect preference
+            return QgsRasterLayer(rasterAdd['OUTPUT'], ('Aspect-Slope -' + str(label)))
+
+        graph.add('gradient', [], gradientStage)
+        graph.add('aspect', ['gradient'], aspectStage)
+        graph.add('slope', ['gradient'], slopeStage)
+        graph.add('classes', ['aspect', 'slope'], classesStage)
+        graph.add('combine', ['classes'], combineStage)
+
+        #symbolise the combined layer based on user selection
+        def renderStage(rasterAddLayer):
+            rasterAddLayer.setRenderer(aspectSlopeRenderer(rasterAddLayer.dataProvider(), aspectViz))
+            return rasterAddLayer
+
+        graph.add('render', ['combine'], renderStage)
+
+        #add the full precision aspect and slope maps only if the user selected yes
+        if aspectYN == 0:
+            QgsProject.instance().addMapLayer(QgsRasterLayer(graph.get('aspect'), 'Aspect'))
+        if slopeYN == 0:
+            QgsProject.instance().addMapLayer(QgsRasterLayer(graph.get('slope'), 'Slope'))
+
+        #run the remaining stages and add the final map
+        QgsProject.instance().addMapLayer(graph.get('render'))
+
         return {}
\ No newline at end of file